@@ -1,12 +1,20 @@
+import json
+import os
+from collections.abc import Callable, Iterator, Mapping
+from datetime import UTC, datetime
 from io import FileIO
-from typing import Any
+from typing import Any, cast
 
+import duckdb
 import pandas as pd
+import pyarrow as pa  # pyright: ignore[reportMissingTypeStubs]
+import pyarrow.compute as pc  # pyright: ignore[reportMissingTypeStubs]
+import pyarrow.parquet as pq  # pyright: ignore[reportMissingTypeStubs]
 import requests
 
 from scapi.util import guess_mime_type
 
-from .api import Formatter
+from .api import Formatter, ShortcutClient
 
 array_fields: list[str] = [
     "branch_ids",
@@ -73,3 +81,539 @@ class PandasFormatter(Formatter):
                 return df.to_csv(file, sep="\t")
             case _:
                 return df.to_csv(file)
+
+
+# Shortcut entity collections that can be queried as DuckDB views, keyed by
+# view name. Stories are not listable, only searchable, so they are fetched
+# via `search_paths` instead.
+entity_paths: dict[str, str] = {
+    "epics": "/epics",
+    "groups": "/groups",
+    "iterations": "/iterations",
+    "labels": "/labels",
+    "members": "/members",
+    "projects": "/projects",
+    "workflows": "/workflows",
+}
+
+search_paths: dict[str, str] = {
+    "stories": "/stories/search",
+}
+
+# Story columns whose comparisons against a constant can be pushed down into
+# the /stories/search date range parameters, e.g., completed_at_start.
+search_date_fields: list[str] = [
+    "completed_at",
+    "created_at",
+    "deadline",
+    "updated_at",
+]
+
+# Story columns whose equality with a constant can be pushed down into the
+# /stories/search parameter of the same name.
+search_equality_fields: list[str] = [
+    "epic_id",
+    "group_id",
+    "iteration_id",
+    "project_id",
+    "requested_by_id",
+    "story_type",
+    "workflow_state_id",
+]
+
+# DuckDB column types of common fields of each collection, used for its view
+# when Shortcut returns no entities at all, e.g., a story search with no
+# matches.
+_timestamps = {"created_at": "TIMESTAMPTZ", "updated_at": "TIMESTAMPTZ"}
+collection_columns: dict[str, dict[str, str]] = {
+    "epics": {
+        "id": "BIGINT",
+        "name": "VARCHAR",
+        "archived": "BOOLEAN",
+        "completed_at": "TIMESTAMPTZ",
+        "deadline": "TIMESTAMPTZ",
+        "epic_state_id": "BIGINT",
+        "owner_ids": "VARCHAR[]",
+        "started_at": "TIMESTAMPTZ",
+    }
+    | _timestamps,
+    "groups": {
+        "id": "VARCHAR",
+        "name": "VARCHAR",
+        "archived": "BOOLEAN",
+        "member_ids": "VARCHAR[]",
+        "mention_name": "VARCHAR",
+    },
+    "iterations": {
+        "id": "BIGINT",
+        "name": "VARCHAR",
+        "end_date": "VARCHAR",
+        "start_date": "VARCHAR",
+        "status": "VARCHAR",
+    }
+    | _timestamps,
+    "labels": {
+        "id": "BIGINT",
+        "name": "VARCHAR",
+        "archived": "BOOLEAN",
+        "color": "VARCHAR",
+    }
+    | _timestamps,
+    "members": {
+        "id": "VARCHAR",
+        "disabled": "BOOLEAN",
+        "role": "VARCHAR",
+        "state": "VARCHAR",
+    }
+    | _timestamps,
+    "projects": {
+        "id": "BIGINT",
+        "name": "VARCHAR",
+        "archived": "BOOLEAN",
+    }
+    | _timestamps,
+    "stories": {
+        "id": "BIGINT",
+        "name": "VARCHAR",
+        "app_url": "VARCHAR",
+        "archived": "BOOLEAN",
+        "blocked": "BOOLEAN",
+        "blocker": "BOOLEAN",
+        "completed": "BOOLEAN",
+        "completed_at": "TIMESTAMPTZ",
+        "cycle_time": "BIGINT",
+        "deadline": "TIMESTAMPTZ",
+        "description": "VARCHAR",
+        "epic_id": "BIGINT",
+        "estimate": "BIGINT",
+        "follower_ids": "VARCHAR[]",
+        "group_id": "VARCHAR",
+        "iteration_id": "BIGINT",
+        "label_ids": "BIGINT[]",
+        "lead_time": "BIGINT",
+        "moved_at": "TIMESTAMPTZ",
+        "owner_ids": "VARCHAR[]",
+        "project_id": "BIGINT",
+        "requested_by_id": "VARCHAR",
+        "started": "BOOLEAN",
+        "started_at": "TIMESTAMPTZ",
+        "story_type": "VARCHAR",
+        "workflow_id": "BIGINT",
+        "workflow_state_id": "BIGINT",
+    }
+    | _timestamps,
+    "workflows": {
+        "id": "BIGINT",
+        "name": "VARCHAR",
+    }
+    | _timestamps,
+}
+
+# pyarrow has no type stubs, so Arrow tables are typed using the same trick
+# as scapi.api.MaybeNone.
+type ArrowTable = Any
+
+_utc_timestamp = pa.timestamp("us", tz="UTC")  # type: ignore
+
+
+def is_timestamp_field(field: str) -> bool:
+    """
+    Whether Shortcut returns the field as an ISO 8601 timestamp string.
+    """
+    return field == "deadline" or field.endswith(("_at", "_at_override"))
+
+
+def to_arrow(rows: list[dict[str, Any]]) -> ArrowTable:
+    """
+    Convert Shortcut's JSON entities into an Arrow table, with a column for
+    every field found in any of the rows and timestamp fields parsed as UTC.
+    """
+    fields = list(dict.fromkeys(field for row in rows for field in row))
+    table = cast(
+        ArrowTable,
+        pa.table({field: [row.get(field) for row in rows] for field in fields}),  # type: ignore
+    )
+    for i, field in enumerate(fields):
+        if is_timestamp_field(field):
+            timestamps: Any = pc.cast(table.column(i), _utc_timestamp)  # type: ignore
+            table = table.set_column(i, field, timestamps)
+    return table
+
+
+def _walk(node: Any) -> Iterator[dict[str, Any]]:
+    if isinstance(node, dict):
+        yield node  # type: ignore
+        for v in node.values():  # type: ignore
+            yield from _walk(v)
+    elif isinstance(node, list):
+        for v in node:  # type: ignore
+            yield from _walk(v)
+
+
+def _parse(query: str) -> dict[str, Any]:
+    """
+    Return DuckDB's own parse tree of the (single statement) query.
+    """
+    serialized = duckdb.sql(
+        "SELECT json_serialize_sql($query)", params={"query": query}
+    ).fetchone()
+    tree: dict[str, Any] = json.loads(serialized[0]) if serialized else {}
+    if tree.get("error"):
+        raise duckdb.ParserException(tree.get("error_message", query))
+    return tree["statements"][0]["node"]
+
+
+def table_names(query: str) -> set[str]:
+    """
+    Names of the tables and views the query reads from, excluding CTEs.
+    """
+    tree = _parse(query)
+    ctes = {
+        entry["key"]
+        for node in _walk(tree)
+        if isinstance(node.get("cte_map"), dict)
+        for entry in node["cte_map"]["map"]
+    }
+    return {
+        node["table_name"] for node in _walk(tree) if node.get("type") == "BASE_TABLE"
+    } - ctes
+
+
+def _constant(node: dict[str, Any]) -> Any:
+    """
+    The Python value of a constant expression, or None if it is not one.
+    """
+    match node:
+        case {"class": "CONSTANT", "value": {"is_null": False, "value": value}}:
+            return value
+        case {
+            "class": "CAST",
+            "cast_type": {"id": "BOOLEAN"},
+            "child": {"class": "CONSTANT"} as child,
+        }:
+            value = _constant(child)
+            return None if value is None else str(value).lower() in ("t", "true")
+        case {"class": "CAST", "child": {"class": "CONSTANT"} as child}:
+            return _constant(child)
+        case _:
+            return None
+
+
+def _cast(connection: duckdb.DuckDBPyConnection, value: Any, type: str) -> Any:
+    """
+    Cast a literal the way DuckDB does when comparing it with a column of the
+    given type, returning None if it can't be cast.
+    """
+    row = connection.execute(
+        f"SELECT TRY_CAST($value AS {type})", {"value": value}
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _timestamp(
+    connection: duckdb.DuckDBPyConnection, value: Any, round_up: bool
+) -> str | None:
+    """
+    Format a date or timestamp literal the way Shortcut's search expects,
+    rounded down (or up) to the second so that it still bounds every row
+    DuckDB will match.
+
+    Literals without a time zone are read in the connection's TimeZone, as
+    DuckDB does when comparing them with TIMESTAMPTZ columns.
+    """
+    row = connection.execute(
+        "SELECT epoch_us(TRY_CAST($value AS TIMESTAMPTZ))", {"value": value}
+    ).fetchone()
+    if row is None or row[0] is None:
+        return None
+    seconds, remainder = divmod(row[0], 1_000_000)
+    if round_up and remainder:
+        seconds += 1
+    return datetime.fromtimestamp(seconds, UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+# Comparison types normalized so that the column is on the left.
+_flipped_comparisons: dict[str, str] = {
+    "COMPARE_EQUAL": "COMPARE_EQUAL",
+    "COMPARE_GREATERTHAN": "COMPARE_LESSTHAN",
+    "COMPARE_GREATERTHANOREQUALTO": "COMPARE_LESSTHANOREQUALTO",
+    "COMPARE_LESSTHAN": "COMPARE_GREATERTHAN",
+    "COMPARE_LESSTHANOREQUALTO": "COMPARE_GREATERTHANOREQUALTO",
+}
+_lower_bounds = {
+    "COMPARE_EQUAL",
+    "COMPARE_GREATERTHAN",
+    "COMPARE_GREATERTHANOREQUALTO",
+}
+_upper_bounds = {"COMPARE_EQUAL", "COMPARE_LESSTHAN", "COMPARE_LESSTHANOREQUALTO"}
+
+
+def _search_params(
+    predicate: dict[str, Any],
+    column: Callable[[dict[str, Any]], str | None],
+    connection: duckdb.DuckDBPyConnection,
+    params: dict[str, Any],
+) -> None:
+    """
+    Add the /stories/search parameters implied by `predicate` to `params`.
+
+    `column` returns the story column a COLUMN_REF node refers to, or None
+    if it does not refer to the stories table. Literals are cast using
+    `connection`. Predicates that cannot be pushed down are ignored; DuckDB
+    still applies the full WHERE clause to whatever is fetched.
+    """
+    match predicate:
+        case {"type": "CONJUNCTION_AND", "children": children}:
+            for child in children:
+                _search_params(child, column, connection, params)
+        case {"class": "COLUMN_REF"} if column(predicate) == "archived":
+            params["archived"] = True
+        case {"type": "OPERATOR_NOT", "children": [child]} if (
+            child.get("class") == "COLUMN_REF" and column(child) == "archived"
+        ):
+            params["archived"] = False
+        case {
+            "type": "FUNCTION",
+            "function_name": "list_contains"
+            | "list_has"
+            | "array_contains"
+            | "array_has",
+            "children": [ref, value],
+        } if ref.get("class") == "COLUMN_REF" and column(ref) == "owner_ids":
+            if (owner_id := _constant(value)) is not None:
+                params["owner_id"] = str(owner_id)
+        case {"type": "COMPARE_BETWEEN", "input": ref, "lower": lower, "upper": upper}:
+            if ref.get("class") == "COLUMN_REF":
+                field = column(ref)
+                if field in search_date_fields:
+                    start = _timestamp(connection, _constant(lower), round_up=False)
+                    if start is not None:
+                        params[f"{field}_start"] = start
+                    end = _timestamp(connection, _constant(upper), round_up=True)
+                    if end is not None:
+                        params[f"{field}_end"] = end
+        case {"class": "COMPARISON", "type": comparison, "left": left, "right": right}:
+            if comparison not in _flipped_comparisons:
+                return
+            if right.get("class") == "COLUMN_REF":
+                comparison = _flipped_comparisons[comparison]
+                left, right = right, left
+            if left.get("class") != "COLUMN_REF":
+                return
+            field = column(left)
+            value = _constant(right)
+            if field is None or value is None:
+                return
+            if field == "archived" and comparison == "COMPARE_EQUAL":
+                # Strings like 'false' are cast by DuckDB when binding, so only
+                # push down actual boolean literals.
+                if isinstance(value, bool):
+                    params["archived"] = value
+            elif field in search_equality_fields and comparison == "COMPARE_EQUAL":
+                # e.g., iteration_id = '42' is sent as the number 42
+                type = collection_columns["stories"][field]
+                if (typed := _cast(connection, value, type)) is not None:
+                    params[field] = typed
+            elif field in search_date_fields:
+                # Strict comparisons are pushed down as inclusive bounds, and
+                # DuckDB filters out any rows fetched at the bound itself.
+                if comparison in _lower_bounds:
+                    start = _timestamp(connection, value, round_up=False)
+                    if start is not None:
+                        params[f"{field}_start"] = start
+                if comparison in _upper_bounds:
+                    end = _timestamp(connection, value, round_up=True)
+                    if end is not None:
+                        params[f"{field}_end"] = end
+        case _:
+            pass
+
+
+def _inner_tables(from_table: dict[str, Any]) -> list[dict[str, Any]]:
+    """
+    The BASE_TABLE nodes of a FROM clause made up only of inner joins, or an
+    empty list if it has anything else in it.
+    """
+    match from_table:
+        case {"type": "BASE_TABLE"}:
+            return [from_table]
+        case {"type": "JOIN", "join_type": "INNER", "left": left, "right": right}:
+            left_tables = _inner_tables(left)
+            right_tables = _inner_tables(right)
+            if left_tables and right_tables:
+                return left_tables + right_tables
+            return []
+        case _:
+            return []
+
+
+def pushdown(
+    query: str,
+    name: str = "stories",
+    connection: duckdb.DuckDBPyConnection | None = None,
+) -> dict[str, Any]:
+    """
+    Return the /stories/search parameters implied by the query's WHERE
+    clause, e.g., `completed_at_start` for `WHERE completed_at > '2024-01-01'`.
+
+    Only simple filters on a stories table that appears once, in an inner
+    join at the top level of the query, are pushed down. Anything else
+    returns no parameters. Literals are interpreted using the settings (e.g.,
+    TimeZone) of the connection the query will run on.
+    """
+    tree = _parse(query)
+    if tree.get("type") != "SELECT_NODE" or not tree.get("where_clause"):
+        return {}
+    refs = [
+        node
+        for node in _walk(tree)
+        if node.get("type") == "BASE_TABLE" and node.get("table_name") == name
+    ]
+    tables = _inner_tables(tree["from_table"])
+    if len(refs) != 1 or refs[0] not in tables:
+        return {}
+    qualifier = refs[0]["alias"] or name
+
+    def column(ref: dict[str, Any]) -> str | None:
+        match ref.get("column_names"):
+            case [field] if len(tables) == 1:
+                return field
+            case [table, field] if table == qualifier:
+                return field
+            case _:
+                return None
+
+    if connection is None:
+        connection = duckdb.connect()
+    params: dict[str, Any] = {}
+    _search_params(tree["where_clause"], column, connection, params)
+    return params
+
+
+class DuckDBQuery:
+    """
+    Query Shortcut entity collections with SQL via DuckDB.
+
+    Collections are exposed as views named after them, e.g., `stories`,
+    `iterations` and `members`. A view can be registered explicitly from a
+    DataFrame, an Arrow table or Parquet files, or loaded from `cache_dir`.
+    Any collection a query refers to that is not registered is fetched from
+    Shortcut's API when the query runs. Simple filters on stories (date
+    ranges, owner, archived, etc.) are pushed down into the search so that
+    only matching stories are fetched.
+    """
+
+    client: ShortcutClient | None
+    cache_dir: str | None
+    connection: duckdb.DuckDBPyConnection
+
+    def __init__(
+        self,
+        client: ShortcutClient | None = None,
+        cache_dir: str | None = None,
+        connection: duckdb.DuckDBPyConnection | None = None,
+    ):
+        self.client = client
+        self.cache_dir = cache_dir
+        self.connection = connection if connection is not None else duckdb.connect()
+        self._views: set[str] = set()
+        if cache_dir is not None:
+            for name in [*entity_paths, *search_paths]:
+                path = self._cache_path(name)
+                if os.path.exists(path):
+                    self.register(name, path)
+
+    def _cache_path(self, name: str) -> str:
+        assert self.cache_dir is not None
+        return os.path.join(self.cache_dir, f"{name}.parquet")
+
+    def register(
+        self, name: str, data: pd.DataFrame | ArrowTable | str | os.PathLike[str]
+    ) -> None:
+        """
+        Expose `data` as a view called `name`. Strings and paths are read as
+        Parquet files and may contain globs.
+        """
+        if isinstance(data, (str, os.PathLike)):
+            path = os.fspath(cast(str | os.PathLike[str], data)).replace("'", "''")
+            self.connection.execute(
+                f"CREATE OR REPLACE VIEW \"{name}\" AS SELECT * FROM read_parquet('{path}')"
+            )
+        else:
+            self.connection.register(name, data)
+        self._views.add(name)
+
+    def unregister(self, name: str) -> None:
+        self.connection.execute(f'DROP VIEW IF EXISTS "{name}"')
+        self._views.discard(name)
+
+    def _register_fetched(self, name: str, table: ArrowTable) -> None:
+        """
+        Register a table fetched from Shortcut's API. If there were no
+        entities, register an empty view with the collection's common
+        columns instead, since an Arrow table without rows has no columns.
+        """
+        if table.num_columns > 0:
+            self.register(name, table)
+            return
+        columns = ", ".join(
+            f'CAST(NULL AS {type}) AS "{column}"'
+            for column, type in collection_columns[name].items()
+        )
+        self.connection.execute(
+            f'CREATE OR REPLACE VIEW "{name}" AS SELECT {columns} LIMIT 0'
+        )
+        self._views.add(name)
+
+    def fetch(self, name: str, params: Mapping[str, Any] | None = None) -> ArrowTable:
+        """
+        Fetch the named collection from Shortcut's API as an Arrow table.
+
+        `params` only apply to searchable collections, i.e., stories.
+        """
+        if self.client is None:
+            raise ValueError(
+                f"No ShortcutClient to fetch {name} with; register it instead."
+            )
+        if name in search_paths:
+            resp = self.client.post(search_paths[name], dict(params or {}))
+        elif name in entity_paths:
+            resp = self.client.get(entity_paths[name])
+        else:
+            raise ValueError(f"Unknown Shortcut collection: {name}")
+        resp.raise_for_status()
+        return to_arrow(resp.json())
+
+    def load(self, name: str) -> None:
+        """
+        Fetch the whole named collection, register it, and write it to the
+        cache if there is one.
+        """
+        table = self.fetch(name)
+        if self.cache_dir is not None and table.num_columns > 0:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            pq.write_table(table, self._cache_path(name))  # type: ignore
+        self._register_fetched(name, table)
+
+    def sql(self, query: str) -> pd.DataFrame:
+        """
+        Run the query, fetching any collections it needs that are not
+        registered yet, and return the result as a DataFrame.
+
+        Listable collections are fetched whole and stay registered (and
+        cached) for later queries. Stories are fetched using the query's
+        pushed down filters, only for the duration of this query.
+        """
+        searched: list[str] = []
+        try:
+            for name in table_names(query) - self._views:
+                if name in search_paths:
+                    searched.append(name)
+                    table = self.fetch(name, pushdown(query, name, self.connection))
+                    self._register_fetched(name, table)
+                elif name in entity_paths:
+                    self.load(name)
+            return self.connection.sql(query).df()
+        finally:
+            for name in searched:
+                self.unregister(name)
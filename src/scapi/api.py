@@ -5,8 +5,12 @@ Simple API client for Shortcut's v3 REST API
 import logging
 import os
 import sys
+import threading
+import time
 from abc import ABC, abstractmethod
 from collections.abc import Callable, Mapping, Sequence
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from enum import Enum
 from io import FileIO
 from typing import Any, NamedTuple, NoReturn, Self, TypeAlias
 
@@ -45,6 +49,134 @@ _limiter: Limiter = Limiter(
     max_delay=Duration.SECOND * _max_limiter_delay_seconds,
 )
 
+# Hedged GETs are limited separately, to a small share of Shortcut's rate limit.
+# A hedge is also only sent if the client's own limiter has budget left right
+# now, so that duplicate requests never cause regular ones to be throttled.
+_max_hedges_per_minute = 20
+_hedge_rate: Rate = Rate(_max_hedges_per_minute, Duration.MINUTE)
+_hedge_limiter: Limiter = Limiter(
+    InMemoryBucket([_hedge_rate]),
+    raise_when_fail=False,
+)
+
+# Timeouts
+#
+# https://requests.readthedocs.io/en/latest/user/advanced/#timeouts
+#
+# Without a timeout, requests will wait forever on a stalled connection. The
+# connect timeout is set just over a multiple of 3 seconds (the default TCP
+# packet retransmission window), and the read timeout is generous enough for
+# Shortcut's slower search endpoints.
+_connect_timeout_seconds = 3.05
+_read_timeout_seconds = 30
+_timeout: tuple[float, float] = (_connect_timeout_seconds, _read_timeout_seconds)
+
+# Circuit Breaking
+#
+# After this many consecutive failures (connection errors, timeouts, or 5xx/429
+# responses), requests fail fast with CircuitOpenError until the reset timeout
+# has passed, at which point a single probe request is let through to check
+# whether Shortcut's API has recovered.
+_circuit_failure_threshold = 5
+_circuit_reset_timeout_seconds = 30
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of making a request while the circuit breaker is open.
+    """
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Fail fast when Shortcut's API is degraded.
+
+    The breaker starts CLOSED. After `failure_threshold` consecutive failures it
+    OPENs and rejects requests with CircuitOpenError. Once `reset_timeout_seconds`
+    have passed it goes HALF_OPEN and lets a single probe request through: if
+    the probe succeeds the breaker CLOSEs again, otherwise it re-OPENs.
+    """
+
+    failure_threshold: int
+    reset_timeout_seconds: float
+    clock: Callable[[], float]
+
+    def __init__(
+        self,
+        failure_threshold: int = _circuit_failure_threshold,
+        reset_timeout_seconds: float = _circuit_reset_timeout_seconds,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> CircuitState:
+        if self._opened_at is None:
+            return CircuitState.CLOSED
+        if self.clock() - self._opened_at >= self.reset_timeout_seconds:
+            return CircuitState.HALF_OPEN
+        return CircuitState.OPEN
+
+    def before_request(self) -> None:
+        """
+        Raise CircuitOpenError if a request should not be made right now.
+        """
+        with self._lock:
+            match self._state():
+                case CircuitState.CLOSED:
+                    return
+                case CircuitState.HALF_OPEN if not self._probing:
+                    self._probing = True
+                    return
+                case _:
+                    raise CircuitOpenError(
+                        f"Circuit breaker is open after {self._failures} consecutive failures"
+                    )
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def cancel_request(self) -> None:
+        """
+        Record that the request allowed by `before_request` was not made.
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = self.clock()
+            self._probing = False
+
+
+def is_failure(response: requests.Response) -> bool:
+    """
+    Whether the response indicates a problem with Shortcut's API, as opposed
+    to a problem with the request itself.
+    """
+    return response.status_code == 429 or response.status_code >= 500
+
 
 class FileUploads(NamedTuple):
     responses: list[requests.Response]
@@ -121,21 +253,80 @@ _formatter = ResponseFormatter()
 
 
 class ShortcutClient:
+    circuit_breaker: CircuitBreaker | None
     formatter: Formatter
+    hedge_after_seconds: float | None
+    hedge_limiter: Limiter
     limiter: Limiter
     logger: logging.Logger
+    timeout: float | tuple[float, float]
     token: str | None
+    url_base: str
 
     def __init__(
         self,
         token: str | None = _token,
         limiter: Limiter = _limiter,
         formatter: Formatter = _formatter,
+        timeout: float | tuple[float, float] = _timeout,
+        circuit_breaker: CircuitBreaker | bool = True,
+        hedge_after_seconds: float | None = None,
+        hedge_limiter: Limiter = _hedge_limiter,
+        url_base: str = _url_base,
     ):
+        """
+        `timeout` is passed to requests as-is, either a single number of seconds
+        or a (connect, read) tuple.
+
+        If `hedge_after_seconds` is set, a GET that has not completed within
+        that many seconds is duplicated, and whichever response arrives first
+        is returned. Hedged requests are only sent while both `hedge_limiter`
+        and `limiter` have budget left, so they only ever use a small share of
+        the rate limit and never wait on it. The request that loses the race
+        is left running until it completes or times out, and its outcome is
+        not recorded with the circuit breaker; call `close()` (or use the
+        client as a context manager) to shut down the threads hedged requests
+        run on.
+
+        By default each client has its own CircuitBreaker. Pass one to share
+        it between clients, or `circuit_breaker=False` to disable circuit
+        breaking.
+        """
+        match circuit_breaker:
+            case CircuitBreaker():
+                self.circuit_breaker = circuit_breaker
+            case True:
+                self.circuit_breaker = CircuitBreaker()
+            case False:
+                self.circuit_breaker = None
         self.formatter = formatter
+        self.hedge_after_seconds = hedge_after_seconds
+        self.hedge_limiter = hedge_limiter
         self.limiter = limiter
         self.logger = logging.getLogger(__name__)
+        self.timeout = timeout
         self.token = token
+        self.url_base = url_base
+        self._executor: ThreadPoolExecutor | None = None
+        self._nowait_limiter: Limiter | None = None
+        if hedge_after_seconds is not None:
+            self._executor = ThreadPoolExecutor(thread_name_prefix="scapi-hedge")
+            # Shares limiter's bucket, but fails immediately instead of waiting
+            self._nowait_limiter = Limiter(limiter.buckets()[0], raise_when_fail=False)
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Shut down the threads used for hedged requests, without waiting for
+        requests that lost the race to finish.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
 
     # From https://docs.python-requests.org/en/latest/api/
     def debug(self) -> None:
@@ -167,6 +358,76 @@ class ShortcutClient:
             exit_callback()
         return self
 
+    def _send(
+        self, send: Callable[..., requests.Response], url: str, **kwargs: Any
+    ) -> requests.Response:
+        """
+        Make the HTTP call with this client's timeout, recording the outcome
+        with the circuit breaker.
+
+        The circuit breaker is checked before acquiring from the rate limiter,
+        so requests rejected by an open circuit don't use up rate budget.
+        """
+        breaker = self.circuit_breaker
+        if breaker is not None:
+            breaker.before_request()
+        try:
+            self.limiter.try_acquire(_bucket_name, 1)
+            resp = send(url, timeout=self.timeout, **kwargs)
+        except requests.RequestException:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        except BaseException:
+            # Throttled or interrupted, so say nothing about Shortcut's health
+            if breaker is not None:
+                breaker.cancel_request()
+            raise
+        if breaker is not None:
+            if is_failure(resp):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+        return resp
+
+    def _try_acquire_hedge(self) -> bool:
+        """
+        Acquire rate budget for a hedged request without waiting, returning
+        False if there is none left.
+        """
+        assert self._nowait_limiter is not None
+        return (
+            self.hedge_limiter.try_acquire(_bucket_name, 1) is True
+            and self._nowait_limiter.try_acquire(_bucket_name, 1) is True
+        )
+
+    def _get_hedged(self, url: str, **kwargs: Any) -> requests.Response:
+        """
+        Make an HTTP GET call, duplicating it if it has not completed after
+        `hedge_after_seconds` and returning whichever response arrives first.
+
+        Used as the `send` function for `_send`, which acquires rate budget
+        for the first request and records only the returned outcome with the
+        circuit breaker.
+        """
+        assert self._executor is not None
+        primary = self._executor.submit(requests.get, url, **kwargs)
+        done, _ = wait([primary], timeout=self.hedge_after_seconds)
+        if done or not self._try_acquire_hedge():
+            return primary.result()
+        self.logger.debug(
+            f"GET hedged after {self.hedge_after_seconds}s url={url} params={kwargs.get('params')}"
+        )
+        hedge = self._executor.submit(requests.get, url, **kwargs)
+        futures: list[Future[requests.Response]] = [primary, hedge]
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        first = done.pop()
+        if first.exception() is None:
+            return first.result()
+        # The first to finish failed, so the other one is our only hope.
+        other = hedge if first is primary else primary
+        return other.result()
+
     def get(
         self, path: str, params: Mapping[str, str] | None = {}
     ) -> requests.Response:
@@ -175,13 +436,12 @@ class ShortcutClient:
 
         Serializes params as url query parameters.
         """
-        self.limiter.try_acquire(_bucket_name, 1)
         path = prefix_slash(path)
-        url = _url_base + path
+        url = self.url_base + path
         self.logger.debug("GET url=%s params=%s headers=%s" % (url, params, _headers))
-        resp = requests.get(
-            url, headers=_headers | {"Shortcut-Token": self.token}, params=params
-        )
+        headers = _headers | {"Shortcut-Token": self.token}
+        send = requests.get if self.hedge_after_seconds is None else self._get_hedged
+        resp = self._send(send, url, headers=headers, params=params)
         self.logger.debug(f"GET response: {resp.status_code} {resp.text}")
         # resp.raise_for_status()
         return resp
@@ -201,12 +461,14 @@ class ShortcutClient:
 
         Typically used to delete an entity.
         """
-        self.limiter.try_acquire(_bucket_name, 1)
         path = prefix_slash(path)
-        url = _url_base + path
+        url = self.url_base + path
         self.logger.debug("DELETE url=%s params=%s headers=%s" % (url, data, _headers))
-        resp = requests.delete(
-            url, headers=_headers | {"Shortcut-Token": self.token}, json=data
+        resp = self._send(
+            requests.delete,
+            url,
+            headers=_headers | {"Shortcut-Token": self.token},
+            json=data,
         )
         self.logger.debug(f"DELETE response: {resp.status_code} {resp.text}")
         # resp.raise_for_status()
@@ -221,12 +483,14 @@ class ShortcutClient:
         may also use a POST request.  Serializes params as JSON in the
         request body.
         """
-        self.limiter.try_acquire(_bucket_name, 1)
         path = prefix_slash(path)
-        url = _url_base + path
+        url = self.url_base + path
         self.logger.debug("POST url=%s params=%s headers=%s" % (url, data, _headers))
-        resp = requests.post(
-            url, headers=_headers | {"Shortcut-Token": self.token}, json=data
+        resp = self._send(
+            requests.post,
+            url,
+            headers=_headers | {"Shortcut-Token": self.token},
+            json=data,
         )
         self.logger.debug(f"POST response: {resp.status_code} {resp.text}")
         # resp.raise_for_status()
@@ -246,12 +510,14 @@ class ShortcutClient:
         Typically used to update an entity.
         Serializes params as JSON in the request body.
         """
-        self.limiter.try_acquire(_bucket_name, 1)
         path = prefix_slash(path)
-        url = _url_base + path
+        url = self.url_base + path
         self.logger.debug("PUT url=%s params=%s headers=%s" % (url, data, _headers))
-        resp = requests.put(
-            url, headers=_headers | {"Shortcut-Token": self.token}, json=data
+        resp = self._send(
+            requests.put,
+            url,
+            headers=_headers | {"Shortcut-Token": self.token},
+            json=data,
         )
         self.logger.debug(f"PUT response: {resp.status_code} {resp.text}")
         # resp.raise_for_status()
@@ -272,8 +538,7 @@ class ShortcutClient:
         of Shortcut File entities that you can then associate with Shortcut Stories
         by specifying their `file_ids`.
         """
-        self.limiter.try_acquire(_bucket_name, 1)
-        url = f"{_url_base}/files"
+        url = f"{self.url_base}/files"
         self.logger.debug(
             "UPLOAD FILES url=%s files=%s headers=%s" % (url, files, _headers)
         )
@@ -288,7 +553,8 @@ class ShortcutClient:
             try:
                 with open(file, "rb") as f:
                     self.logger.debug(f"File: {f.name} {guess_mime_type(f.name)}")
-                    resp = requests.post(
+                    resp = self._send(
+                        requests.post,
                         url,
                         headers=headers,
                         files=[
@@ -1,9 +1,14 @@
+import pathlib
 import typing
 
+import duckdb
 import pandas as pd
+import pytest
+import requests
 import responses
+from responses import matchers
 
-from scapi.analysis import PandasFormatter
+from scapi.analysis import DuckDBQuery, PandasFormatter, pushdown, to_arrow
 from scapi.api import ShortcutClient
 
 example_epics = [
@@ -74,3 +79,196 @@ def test_pandas_formatter_standalone():
     df = typing.cast(pd.DataFrame, pf.object(x))
     assert (2, 21) == df.shape
     assert df[df["archived"]].shape == (1, 21)
+
+
+def utc() -> duckdb.DuckDBPyConnection:
+    connection = duckdb.connect()
+    connection.execute("SET TimeZone = 'UTC'")
+    return connection
+
+
+def test_pushdown():
+    assert pushdown(
+        """
+        SELECT id FROM stories
+         WHERE completed_at > '2024-01-01'
+           AND '2024-06-30T12:00:00Z' >= completed_at
+           AND NOT archived
+           AND list_contains(owner_ids, '12345678-9012-3456-7890-123456789012')
+           AND iteration_id = 42
+        """,
+        connection=utc(),
+    ) == {
+        "archived": False,
+        "completed_at_end": "2024-06-30T12:00:00Z",
+        "completed_at_start": "2024-01-01T00:00:00Z",
+        "iteration_id": 42,
+        "owner_id": "12345678-9012-3456-7890-123456789012",
+    }
+    assert pushdown(
+        """
+        SELECT s.id, m.name FROM stories s JOIN members m ON m.id = s.requested_by_id
+         WHERE s.created_at BETWEEN '2024-01-01' AND '2024-02-01' AND archived
+        """,
+        connection=utc(),
+    ) == {
+        "created_at_end": "2024-02-01T00:00:00Z",
+        "created_at_start": "2024-01-01T00:00:00Z",
+    }
+    # DuckDB casts 'false' when binding, so it must not be pushed down as True
+    assert pushdown("SELECT * FROM stories WHERE archived = 'false'") == {}
+    assert pushdown("SELECT * FROM stories WHERE archived = false") == {
+        "archived": False
+    }
+    # Bounds are widened to whole seconds
+    assert pushdown(
+        """
+        SELECT * FROM stories
+         WHERE completed_at > '2024-01-01 10:00:00.5'
+           AND completed_at < '2024-01-02 10:00:00.5'
+        """,
+        connection=utc(),
+    ) == {
+        "completed_at_end": "2024-01-02T10:00:01Z",
+        "completed_at_start": "2024-01-01T10:00:00Z",
+    }
+    # Literals are cast to the column's type, or not pushed down at all
+    assert pushdown("SELECT * FROM stories WHERE iteration_id = '42'") == {
+        "iteration_id": 42
+    }
+    assert pushdown("SELECT * FROM stories WHERE iteration_id = 'x'") == {}
+    # Disjunctions can't be pushed down without losing rows
+    assert (
+        pushdown("SELECT * FROM stories WHERE completed_at > '2024-01-01' OR archived")
+        == {}
+    )
+
+
+@responses.activate
+def test_duckdb_query_pushdown():
+    search = responses.post(
+        "https://api.app.shortcut.com/api/v3/stories/search",
+        json=[
+            {
+                "id": 1,
+                "archived": False,
+                "completed_at": "2024-03-01T00:00:00Z",
+                "iteration_id": 7,
+            },
+            {
+                "id": 2,
+                "archived": False,
+                "completed_at": "2024-04-01T00:00:00Z",
+                "iteration_id": 7,
+            },
+        ],
+        match=[
+            matchers.json_params_matcher(
+                {"archived": False, "completed_at_start": "2024-01-01T00:00:00Z"}
+            )
+        ],
+    )
+    iterations = responses.get(
+        "https://api.app.shortcut.com/api/v3/iterations",
+        json=[{"id": 7, "name": "Iteration 7"}, {"id": 8, "name": "Iteration 8"}],
+    )
+    q = DuckDBQuery(ShortcutClient(token="testtoken"), connection=utc())
+    query = """
+    SELECT it.name, count(*) AS num_completed_stories
+      FROM stories s JOIN iterations it ON it.id = s.iteration_id
+     WHERE s.completed_at > '2024-01-01' AND NOT s.archived
+    GROUP BY it.name
+    """
+    df = q.sql(query)
+    assert isinstance(df, pd.DataFrame)
+    assert df.to_dict("records") == [
+        {"name": "Iteration 7", "num_completed_stories": 2}
+    ]
+    # Iterations stay registered, stories are searched again per query
+    q.sql(query)
+    assert search.call_count == 2
+    assert iterations.call_count == 1
+
+
+@responses.activate
+def test_duckdb_query_cache(tmp_path: pathlib.Path):
+    members = responses.get(
+        "https://api.app.shortcut.com/api/v3/members",
+        json=[{"id": "a", "disabled": False}, {"id": "b", "disabled": True}],
+    )
+    client = ShortcutClient(token="testtoken")
+    q = DuckDBQuery(client, cache_dir=str(tmp_path))
+    assert q.sql("SELECT count(*) AS n FROM members")["n"][0] == 2
+    assert (tmp_path / "members.parquet").exists()
+    q = DuckDBQuery(client, cache_dir=str(tmp_path))
+    assert q.sql("SELECT id FROM members WHERE NOT disabled")["id"].tolist() == ["a"]
+    assert members.call_count == 1
+
+
+def test_duckdb_query_register():
+    q = DuckDBQuery()
+    q.register("epics", pd.DataFrame(example_epics))
+    df = q.sql("SELECT id FROM epics WHERE archived")
+    assert df["id"].tolist() == [234]
+
+
+@responses.activate
+def test_duckdb_query_no_stories():
+    responses.post("https://api.app.shortcut.com/api/v3/stories/search", json=[])
+    q = DuckDBQuery(ShortcutClient(token="testtoken"))
+    df = q.sql("SELECT id FROM stories WHERE completed_at > '2030-01-01'")
+    assert df.shape == (0, 1)
+
+
+@responses.activate
+def test_duckdb_query_failed_fetch():
+    search = responses.post(
+        "https://api.app.shortcut.com/api/v3/stories/search",
+        json=[{"id": 1, "archived": True, "iteration_id": 7}],
+    )
+    responses.get("https://api.app.shortcut.com/api/v3/iterations", status=500)
+    q = DuckDBQuery(ShortcutClient(token="testtoken", circuit_breaker=False))
+    with pytest.raises(requests.HTTPError):
+        q.sql(
+            """
+            SELECT s.id FROM stories s JOIN iterations it ON it.id = s.iteration_id
+             WHERE s.archived
+            """
+        )
+    # The archived-only search from the failed query is not reused
+    search.calls.reset()
+    q.sql("SELECT count(*) FROM stories WHERE NOT archived")
+    assert search.call_count == 1
+
+
+def test_to_arrow():
+    table = to_arrow(
+        [
+            {"id": 1, "completed_at": None},
+            {"id": 2, "completed_at": "2024-01-05T12:30:00.123Z", "deadline": None},
+        ]
+    )
+    assert table.column_names == ["id", "completed_at", "deadline"]
+    assert str(table.schema.field("completed_at").type) == "timestamp[us, tz=UTC]"
+    assert str(table.schema.field("deadline").type) == "timestamp[us, tz=UTC]"
+    q = DuckDBQuery()
+    q.register("stories", table)
+    df = q.sql("SELECT id FROM stories WHERE completed_at > '2024-1-5'")
+    assert df["id"].tolist() == [2]
+
+
+@responses.activate
+def test_duckdb_query_time_zone():
+    search = responses.post(
+        "https://api.app.shortcut.com/api/v3/stories/search",
+        json=[{"id": 1, "completed_at": "2024-01-01T03:00:00Z"}],
+        match=[
+            matchers.json_params_matcher({"completed_at_end": "2024-01-01T05:00:00Z"})
+        ],
+    )
+    q = DuckDBQuery(ShortcutClient(token="testtoken"))
+    q.connection.execute("SET TimeZone = 'America/New_York'")
+    # Midnight in New York is 05:00 UTC, after the story was completed
+    df = q.sql("SELECT id FROM stories WHERE completed_at < '2024-01-01'")
+    assert df["id"].tolist() == [1]
+    assert search.call_count == 1
@@ -1,8 +1,16 @@
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
 import pytest
 import requests
 import responses
+from pyrate_limiter import BucketFullException, Duration, InMemoryBucket, Limiter, Rate
 
 from scapi import ShortcutClient
+from scapi.api import CircuitBreaker, CircuitOpenError, CircuitState
 
 testClient = ShortcutClient(token="testtoken")
 
@@ -196,3 +204,240 @@ def test_sc_put_not_ok():
     responses.add(resp)
     with pytest.raises(requests.HTTPError):
         testClient.put(path)
+
+
+def test_circuit_breaker():
+    now = [0.0]
+    breaker = CircuitBreaker(
+        failure_threshold=2, reset_timeout_seconds=10, clock=lambda: now[0]
+    )
+    assert breaker.state == CircuitState.CLOSED
+    breaker.before_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    now[0] = 10.0
+    assert breaker.state == CircuitState.HALF_OPEN
+    breaker.before_request()
+    # Only a single probe is let through while half-open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    now[0] = 20.0
+    breaker.before_request()
+    breaker.record_success()
+    assert breaker.state == CircuitState.CLOSED
+
+
+@responses.activate
+def test_sc_get_circuit_open():
+    path = "/member"
+    url = f"https://api.app.shortcut.com/api/v3{path}"
+    responses.add(responses.Response(method="GET", url=url, status=503))
+    client = ShortcutClient(
+        token="testtoken",
+        circuit_breaker=CircuitBreaker(failure_threshold=2),
+    )
+    assert client.get(path).status_code == 503
+    assert client.get(path).status_code == 503
+    with pytest.raises(CircuitOpenError):
+        client.get(path)
+    assert len(responses.calls) == 2
+
+
+def test_sc_circuit_breaker_per_client():
+    assert ShortcutClient().circuit_breaker is not ShortcutClient().circuit_breaker
+    breaker = CircuitBreaker()
+    assert ShortcutClient(circuit_breaker=breaker).circuit_breaker is breaker
+    assert ShortcutClient(circuit_breaker=False).circuit_breaker is None
+
+
+def test_sc_get_interrupted_probe(monkeypatch: pytest.MonkeyPatch):
+    def interrupt(*args: Any, **kwargs: Any) -> requests.Response:
+        raise KeyboardInterrupt
+
+    now = [0.0]
+    breaker = CircuitBreaker(
+        failure_threshold=1, reset_timeout_seconds=10, clock=lambda: now[0]
+    )
+    breaker.record_failure()
+    now[0] = 10.0
+    client = ShortcutClient(token="testtoken", circuit_breaker=breaker)
+    monkeypatch.setattr(requests, "get", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        client.get("/member")
+    # The interrupted probe doesn't leave the breaker open forever
+    assert breaker.state == CircuitState.HALF_OPEN
+    breaker.before_request()
+
+
+def limiter(requests_per_minute: int, raise_when_fail: bool = True) -> Limiter:
+    return Limiter(
+        InMemoryBucket([Rate(requests_per_minute, Duration.MINUTE)]),
+        raise_when_fail=raise_when_fail,
+    )
+
+
+@responses.activate
+def test_sc_get_circuit_open_no_rate_budget():
+    path = "/member"
+    url = f"https://api.app.shortcut.com/api/v3{path}"
+    responses.add(responses.Response(method="GET", url=url, status=503))
+    now = [0.0]
+    breaker = CircuitBreaker(
+        failure_threshold=1, reset_timeout_seconds=10, clock=lambda: now[0]
+    )
+    client = ShortcutClient(
+        token="testtoken", limiter=limiter(2), circuit_breaker=breaker
+    )
+    client.get(path)
+    # Fail-fast requests don't use up the rate limit
+    for _ in range(5):
+        with pytest.raises(CircuitOpenError):
+            client.get(path)
+    now[0] = 10.0
+    client.get(path)
+    now[0] = 20.0
+    # A half-open probe that is throttled doesn't leave the breaker stuck
+    with pytest.raises(BucketFullException):
+        client.get(path)
+    assert breaker.state == CircuitState.HALF_OPEN
+    breaker.before_request()
+
+
+class StandInServer:
+    """
+    Local stand-in for Shortcut's API that responds slowly to every
+    `slow_every`th request, with `slow_status`.
+    """
+
+    def __init__(self, slow_every: int, slow_seconds: float, slow_status: int = 200):
+        self.requests = 0
+        lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with lock:
+                    server.requests += 1
+                    n = server.requests
+                status = 200
+                if n % slow_every == 0:
+                    time.sleep(slow_seconds)
+                    status = slow_status
+                body = b"{}"
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url_base = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args: object):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def p99_get_seconds(client: ShortcutClient, n: int) -> float:
+    latencies: list[float] = []
+    for _ in range(n):
+        start = time.perf_counter()
+        client.get("/member")
+        latencies.append(time.perf_counter() - start)
+    return statistics.quantiles(latencies, n=100)[98]
+
+
+def test_sc_get_timeout():
+    with StandInServer(slow_every=1, slow_seconds=0.5) as server:
+        client = ShortcutClient(
+            token="testtoken",
+            timeout=(1, 0.1),
+            circuit_breaker=False,
+            url_base=server.url_base,
+        )
+        with pytest.raises(requests.Timeout):
+            client.get("/member")
+
+
+def test_sc_get_hedged_p99():
+    with StandInServer(slow_every=5, slow_seconds=0.5) as server:
+        unhedged = ShortcutClient(
+            token="testtoken", circuit_breaker=False, url_base=server.url_base
+        )
+        with ShortcutClient(
+            token="testtoken",
+            circuit_breaker=False,
+            hedge_after_seconds=0.05,
+            hedge_limiter=limiter(20, raise_when_fail=False),
+            url_base=server.url_base,
+        ) as hedged:
+            assert p99_get_seconds(unhedged, 20) >= 0.5
+            assert p99_get_seconds(hedged, 20) < 0.5
+
+
+def test_sc_get_hedge_budget():
+    with StandInServer(slow_every=1, slow_seconds=0.2) as server:
+        client = ShortcutClient(
+            token="testtoken",
+            circuit_breaker=False,
+            hedge_after_seconds=0.05,
+            hedge_limiter=limiter(1, raise_when_fail=False),
+            url_base=server.url_base,
+        )
+        with client:
+            client.get("/member")
+            assert server.requests == 2
+            # No hedge budget left, so this waits on the slow primary
+            client.get("/member")
+            assert server.requests == 3
+
+
+def test_sc_get_hedge_main_budget():
+    with StandInServer(slow_every=1, slow_seconds=0.2) as server:
+        client = ShortcutClient(
+            token="testtoken",
+            limiter=limiter(1),
+            circuit_breaker=False,
+            hedge_after_seconds=0.05,
+            hedge_limiter=limiter(20, raise_when_fail=False),
+            url_base=server.url_base,
+        )
+        with client:
+            # The only request within the rate limit can't be hedged
+            client.get("/member")
+            assert server.requests == 1
+            with pytest.raises(BucketFullException):
+                client.get("/member")
+
+
+def test_sc_get_hedge_loser_not_recorded():
+    with StandInServer(slow_every=1, slow_seconds=0.3, slow_status=503) as server:
+        breaker = CircuitBreaker(failure_threshold=1)
+        client = ShortcutClient(
+            token="testtoken",
+            circuit_breaker=breaker,
+            hedge_after_seconds=0.05,
+            hedge_limiter=limiter(20, raise_when_fail=False),
+            url_base=server.url_base,
+        )
+        with client:
+            # Both requests are slow, the first to respond is the primary
+            assert client.get("/member").status_code == 503
+            assert breaker.state == CircuitState.OPEN
+            breaker.record_success()
+            time.sleep(0.1)
+            # The hedge's (also failed) response arrived after the winner
+            assert breaker.state == CircuitState.CLOSED